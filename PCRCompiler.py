@@ -27,7 +27,14 @@ that are merely ignored.
 
 import re
 
-_reps_re = re.compile("^x[0-9]+:?$")
+# Fast path for the usual step line, "XXs @ YYC Description"; the s, C and
+# description are optional. The C must be followed by whitespace or end-of-line
+# so "95 Cool" keeps its title. Other spellings go through parse_step_line's
+# lenient fallback.
+_step_re = re.compile(r"^\s*(\d+)s?\s*@\s*(\d+(?:\.\d+)?)c?(?:\s+(.*?))?\s*$", re.I)
+# End-of-line whitespace plus the line boundary after it, for every boundary
+# str.splitlines() knows (\r\n, \r, \v, \f, \x1c-\x1e, \x85, U+2028/9).
+_eol_re = re.compile(r"[^\S\n\r\v\f\x1c-\x1e\x85\u2028\u2029]*(?:\r\n|[\n\r\v\f\x1c-\x1e\x85\u2028\u2029])")
 
 class PCRStep:
     def __init__(self, seconds, temperature, title=''):
@@ -39,7 +46,7 @@ class PCRStep:
         return "PCRStep({0}, {1}, '{2}')".format(self.seconds, self.temperature, self.title)
 
     def __str__(self):
-        return '[{0}|{1}|{2}]'.format(self.seconds, self.temperature, self.title)
+        return f'[{self.seconds}|{self.temperature}|{self.title}]'
 
 class PCRCycle:
     def __init__(self, reps, *steps):
@@ -50,7 +57,7 @@ class PCRCycle:
         return "PCRCycle({0}, {1})".format(self.reps, ', '.join(repr(x) for x in self.steps))
 
     def __str__(self):
-        return '({0}{1})'.format(self.reps, ''.join([str(x) for x in self.steps]))
+        return f"({self.reps}{''.join(map(str, self.steps))})"
 
 class OpenPCRProgram:
     'Contains title, lid temperature, and a list of sub-steps. Can emit OpenPCR program strings.'
@@ -63,11 +70,23 @@ class OpenPCRProgram:
         return "OpenPCRProgram({0}, title='{1}', lid={2})".format(', '.join(repr(x) for x in self.cycles), self.title, self.lid)
 
     def __str__(self):
-        return 's=ACGTC&l={0}&c=start&n={1}&p={2}'.format(self.lid, self.title, ''.join([str(x) for x in self.cycles]))
+        return f"s=ACGTC&l={self.lid}&c=start&n={self.title}&p={''.join(map(str, self.cycles))}"
 
 def count_indent(some_str):
-    'Only applies to space characters; returns the number of indents. Not very performant.'
-    return some_str.count(" ", 0, some_str.index(some_str.lstrip(" ")[0]) )
+    'Only applies to space characters; returns the number of indents.'
+    n = 0
+    for c in some_str:
+        if c != ' ':
+            break
+        n += 1
+    return n
+
+def _is_reps(line):
+    'True for repetition lines of the form "x35" or "x35:".'
+    if line[:1] != 'x': # Step lines begin with a digit; bail before slicing.
+        return False
+    reps = line[1:-1] if line[-1] == ':' else line[1:]
+    return reps.isascii() and reps.isdigit()
 
 def parse_step_line(line):
     '''Steps of a PCR program are expected in this format: "XXs @ YYC Description",
@@ -75,25 +94,33 @@ def parse_step_line(line):
     can be empty; this is the message that will be displayed on OpenPCR's screen, and
     should be sized to match. Descriptions add to program length, and as there is a
     maximum length, this should be considered when writing programs.'''
-    line = line.strip()
-    seconds, rest = [x.strip() for x in line.split("@")]
-    if not rest:
-        raise Exception("At least time and temperature must be specified in a step-defining line: '{0}'".format(line))
-    seconds = seconds.lower().strip("s") # The s is really for clarity, can be omitted without bugs.. don't tell anyone!
-    temperature, title = [x.strip() for x in rest.split(None,1)]
-    temperature = temperature.lower().strip("c")
+    m = _step_re.match(line)
+    if m:
+        seconds, temperature, title = m.groups()
+    else:
+        # Anything the regex doesn't cover ("30 s", "+95", ".5C" and so on) gets
+        # the original, more lenient split; this also explains malformed lines.
+        line = line.strip()
+        seconds, sep, rest = line.partition("@")
+        rest = rest.split(None, 1)
+        if not sep or not rest:
+            raise Exception("At least time and temperature must be specified in a step-defining line: '{0}'".format(line))
+        seconds = seconds.strip().lower().strip("s") # The s is really for clarity, can be omitted without bugs.. don't tell anyone!
+        temperature = rest[0].lower().strip("c")
+        title = rest[1].strip() if len(rest) > 1 else ''
     try:
         seconds = int(seconds)
-    except:
+    except ValueError:
         raise Exception("Error: line contains non-permitted character where specifying time: '{0}'".format(line))
     try:
         temperature = float(temperature)
         if int(temperature) == temperature:
             temperature = int(temperature) # Save program space by omitting decimals.
-        if temperature < 0 or temperature > 99:
-            raise Exception("Error: OpenPCR should not be instructed to cool below freezing or heat above boiling.")
-    except:
+    except (ValueError, OverflowError):
         raise Exception("Error: Line contains non-permitted character where specifying temperature: '{0}'".format(line))
+    if temperature < 0 or temperature > 99:
+        raise Exception("Error: OpenPCR should not be instructed to cool below freezing or heat above boiling.")
+    title = title or ''
     return PCRStep(seconds, temperature, title)
 
 def parse_program(prog_string):
@@ -111,15 +138,18 @@ def parse_program(prog_string):
         30s @ 68 Annealing
         30s @ 72 Extension
     '''
-    # First, remove flanking whitespace, and end-of-line whitespace.
-    prog_string = '\n'.join([x.rstrip() for x in prog_string.strip().splitlines()])
+    # First, remove flanking whitespace, and end-of-line whitespace; every line
+    # ending becomes a plain \n.
+    prog_string = _eol_re.sub('\n', prog_string.strip())
 
     # Split into headers and program lines.
     prog_headers, prog = prog_string.split("\n\n",1)
     headers = {}
     for line in prog_headers.splitlines():
-        tag, value = [x.strip() for x in line.split(":",1)]
-        headers[tag.lower()] = value.replace("&","+").replace("=",":") # Removing reserved YAML characters because shut up
+        tag, sep, value = line.partition(":")
+        if not sep:
+            raise Exception("Header lines must be of form 'Key: value': '{0}'".format(line))
+        headers[tag.strip().lower()] = value.strip().replace("&","+").replace("=",":") # Removing reserved YAML characters because shut up
 
     # Extract the two headers actually used; rest ignored.
     program_title = headers.get('title','')
@@ -136,15 +166,20 @@ def parse_program(prog_string):
     current_cycle_steps = []
     current_cycle_reps = 1
     current_indent = 0
+    # Bound methods kept local for the per-line loop; steps_append must be
+    # rebound whenever current_cycle_steps is replaced.
+    cycles_append = cycles.append
+    steps_append = current_cycle_steps.append
     for line in prog.splitlines():
         current_line += 1
         indent = count_indent(line)
         if indent < current_indent:
             # Dedent means end of previous block, so use information to compile
             # a cycle and reset current_cycle_xxx bits.
-            cycles.append(PCRCycle(current_cycle_reps, *current_cycle_steps))
+            cycles_append(PCRCycle(current_cycle_reps, *current_cycle_steps))
             current_cycle_reps = 1
             current_cycle_steps = []
+            steps_append = current_cycle_steps.append
             current_indent = indent
         elif indent > current_indent > 0:
             raise Exception("Indentation must be consistent within program cycle blocks, and only one depth of indentation is currently supported.")
@@ -153,16 +188,16 @@ def parse_program(prog_string):
             # If we already have steps accumulated, then this is erroneous further indentation!
             if current_cycle_steps:
                 raise Exception("Additional steps indented above existing cycle depth on line {0}: '{1}'".format(current_line, line))
-            current_cycle_steps.append(parse_step_line(line))
+            steps_append(parse_step_line(line))
             current_indent = indent
         elif indent == current_indent and current_indent > 0:
             # Continued indented block of a cycle.
-            current_cycle_steps.append(parse_step_line(line))
+            steps_append(parse_step_line(line))
             current_indent = indent
         if indent == current_indent == 0:
             # Can only currently be either a number of repetitions for ensuing block,
             # or a single step, presumed non-repeated.
-            if _reps_re.match(line):
+            if _is_reps(line):
                 # Is a repetition-line, process to extract integer value
                 # First check if repetition has previously been given; bug out
                 if current_cycle_reps != 1:
@@ -176,12 +211,12 @@ def parse_program(prog_string):
                 else:
                     # Parse line into time, temp and title, drop into PCRStep, then
                     # into PCRCycle, then into steps.
-                    cycles.append(PCRCycle(parse_step_line(line)))
+                    cycles_append(PCRCycle(parse_step_line(line)))
             current_indent = indent
     else:
         # Runs at end of For-loop to clean-up.
         if current_cycle_steps:
-            cycles.append(PCRCycle(current_cycle_reps, *current_cycle_steps))
+            cycles_append(PCRCycle(current_cycle_reps, *current_cycle_steps))
     return str(OpenPCRProgram(*cycles, title=program_title, lid=lid_temperature))
 
 if __name__ == "__main__":
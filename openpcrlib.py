@@ -1,46 +1,118 @@
 import time
 import sys
 import os
-import collections
+import re
+import mmap
+import errno
+import functools
+import operator
 
 if "linux" not in sys.platform:
     print("OpenPyCR uses system calls that are only available on Linux platforms. Your platform -",
             sys.platform,"- is probably incompatible, so reading OpenPCR status is probably impossible and this",
             "program will probably crash. This is *not a bug* if you are using a platform other",
             "than linux, and there is no plan to support non-free/libre platforms.", file=sys.stderr)
-if sys.version_info[:2] < (3,3):
-    # native posix_fadvise introduced in 3.3, can shim in with ctypes:
-    print("Your Python version is outdated and lacks the posix_fadvise system call in os.",
-          "Attempting to shim this in using ctypes..", file=sys.stderr)
-    import ctypes
-    try:
-        os.POSIX_FADV_NORMAL     = 0
-        os.POSIX_FADV_RANDOM     = 1
-        os.POSIX_FADV_SEQUENTIAL = 2
-        os.POSIX_FADV_WILLNEED   = 3
-        os.POSIX_FADV_DONTNEED   = 4
-        os.POSIX_FADV_NOREUSE    = 5
-        # The above will (or should?) always work, so do that first.
-        libc = ctypes.CDLL("libc.so.6")
-        os.posix_fadvise = libc.posix_fadvise
-        print("posix_fadvise shim successful, nothing to see here. Consider updating Python anyway.", file=sys.stderr)
-    except OSError:
-        print("Attempted to open libc.so.6 to import the posix_fadvise system call failed.",
-              "Reading from OpenPCR will not function correctly as disk/os level caching will interfere.",file=sys.stderr)
-        # Add an empty shim so it doesn't crash later.
-        if not hasattr(os, "posix_fadvise"): os.posix_fadvise = lambda w,x,y,a:None
+
+# Bound once here so ncc needn't look it up on os for every read. Missing off Linux.
+_fadvise = getattr(os, "posix_fadvise", None)
+# OPENPYCR_FADVISE=1 restores the old status read: a plain read after dropping
+# cached pages with posix_fadvise, instead of an O_DIRECT read.
+_USE_FADVISE = os.environ.get("OPENPYCR_FADVISE") == "1"
+_nonce_re = re.compile("&d=[^&]*")
+# Anchored to a field start, so a longer key like "ab=" isn't read as "b=".
+_status_re = re.compile(rb"(?:^|&)([a-z])=([^&]*)")
+# STATUS.TXT key -> (readstatus key, conversion from raw bytes); unknown keys are ignored.
+_status_fields = {b's': ('state', bytes.decode),
+                  b't': ('job', bytes.decode),
+                  b'b': ('blocktemp', float),
+                  b'l': ('lidtemp', float),
+                  b'e': ('elapsedsecs', int),
+                  b'r': ('secsleft', int),
+                  b'p': ('currentstep', bytes.decode),
+                  b'c': ('cycle', int),
+                  b'n': ('program', bytes.decode),
+                  b'd': ('nonce', int),
+                  }
+# Values used for any key the device leaves out.
+_status_defaults = {'state': 'Unknown',
+                    'job': 'Unknown',
+                    'blocktemp': 0.0,
+                    'lidtemp': 0.0,
+                    'elapsedsecs': 0,
+                    'secsleft': 0,
+                    'currentstep': 'Unknown',
+                    'cycle': 0,
+                    'program': 'Unknown',
+                    'nonce': -1,
+                    }
+_STATUS_READ_SIZE = 4096 # One page; the status text ends well before this.
+_O_DIRECT = getattr(os, "O_DIRECT", 0)
+
+_tz_window = -1 # Start of the quarter hour that _tz_offset applies to.
+_tz_offset = 0
+
+def _currenttime():
+    '''Local time as HH:MM:SS, for readstatus. The UTC offset is only looked up
+    once per quarter hour (DST changes fall on those boundaries), so most calls
+    are integer arithmetic rather than localtime() and strftime().'''
+    global _tz_window, _tz_offset
+    t = int(time.time())
+    if not _tz_window <= t < _tz_window + 900:
+        _tz_window = t - t % 900
+        _tz_offset = time.localtime(_tz_window).tm_gmtoff
+    t = (t + _tz_offset) % 86400
+    return f'{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}'
+
+@functools.lru_cache(maxsize=8)
+def _csv_getter(keyorder):
+    '''Returns a function picking keyorder's values out of a status dictionary
+    as a tuple, in one C call; keyorder must be a tuple to be cached.'''
+    if not keyorder:
+        return lambda d: ()
+    if len(keyorder) == 1: # itemgetter with one key returns the bare value.
+        key, = keyorder
+        return lambda d: (d[key],)
+    return operator.itemgetter(*keyorder)
 
 class OpenPCRError(Exception):
     pass
 
 class OpenPCR:
     def __init__(self,devicepath=''):
+        self._status_fd = None # STATUS.TXT, held open across polls; see _open_status.
+        self._status_id = None # (st_dev, st_ino) of the file self._status_fd refers to.
+        self._status_cached = False
+        self._status_direct = bool(_O_DIRECT) and not _USE_FADVISE # Cleared if O_DIRECT is refused.
         self.devicepath = devicepath or '/media/OPENPCR/'
         self.active = False
+        self._status_buf = mmap.mmap(-1, _STATUS_READ_SIZE) # Page-aligned, for O_DIRECT reads.
+        # Last raw status text and its parsed form, see readstatus.
+        self._last_statustxt = None
+        self._last_status = None
+
+    @property
+    def devicepath(self):
+        return self._devicepath
+
+    @devicepath.setter
+    def devicepath(self, path):
+        # File paths are joined here once rather than on every read or write.
+        self.close()
+        self._devicepath = path
+        self._status_path = os.path.join(path, 'STATUS.TXT')
+        self._control_path = os.path.join(path, 'CONTROL.TXT')
+
+    def _stat_status(self):
+        'Returns os.stat of STATUS.TXT, or None if it is missing.'
+        # STATUS.TXT existing implies the device path does; one stat covers both.
+        try:
+            return os.stat(self._status_path)
+        except OSError:
+            return None
 
     @property
     def ready(self):
-        return os.path.exists(self.devicepath) and os.path.exists(os.path.join(self.devicepath,"STATUS.TXT"))
+        return self._stat_status() is not None
         
     def sendprogram(self, program, status_callback=lambda x:None):
         '''Sends a program to the OpenPCR and prints a verification if successful.
@@ -48,22 +120,22 @@ class OpenPCR:
         if not self.ready:
             raise OpenPCRError("Cannot send program as device is not ready.")
 
-        NewNonce = self.readstatus()['nonce'] + 1 if CurrentNonce < 100 else 1 # Overflow; no need for excess digits.
-        # OrderedDict preserves key order; may be critical for leading 's=ACGTC' signal.
-        dissectedprogram = collections.OrderedDict([x.split("=",1) for x in program.split("&")])
-        dissectedprogram['d'] = str(NewNonce)
-        self._sendprogram('&'.join(['='.join([x,y]) for x,y in dissectedprogram.items()]))
+        CurrentNonce = self.readstatus(force=True)['nonce']
+        NewNonce = CurrentNonce + 1 if CurrentNonce < 100 else 1 # Overflow; no need for excess digits.
+        # Drop any existing nonce and append the new one; the leading 's=ACGTC'
+        # signal, which may be critical, stays in place.
+        self._sendprogram(_nonce_re.sub('', program) + '&d=' + str(NewNonce))
 
         # Wait 2s to let OpenPCR recover from sending program, 
         # then further 5s for program update.
         status_callback("Waiting for two seconds for OpenPCR to resume responding.")
         Status = time.sleep(2) # Now Status == None, not undefined.
-        started_waiting = time.time()
-        while time.time() - started_waiting < 5:
+        deadline = time.monotonic() + 5 # Monotonic, so clock adjustments can't cut this short.
+        while time.monotonic() < deadline:
             try:
-                Status = self.readstatus()
+                Status = self.readstatus(force=True)
                 break
-            except ValueError:
+            except (ValueError, IOError):
                 status_callback("Still waiting for OpenPCR to respond..")
                 time.sleep(0.5)
         else:
@@ -78,8 +150,14 @@ class OpenPCR:
             raise OpenPCRError("Program sent to device but device does not report receipt.")
 
     def _sendprogram(self,program):
-        with open(os.path.join(self.devicepath,'CONTROL.TXT'), mode='w') as Fout:
-            Fout.write(program)
+        # fsync so the write reaches the device now rather than sitting in the
+        # page cache, where the firmware can't see it.
+        fd = os.open(self._control_path, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, program.encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
     def test(self):
         # Expand here; this should test sending, sequential status reads, and stopping.
@@ -88,47 +166,119 @@ class OpenPCR:
     def stop(self):
         self.sendprogram('s=ACGTC&c=stop')
 
-    def ncc(self):
-        '''Low-level. Calls ncc binary for appropriate platform, returns raw output as string.
+    def _open_status(self):
+        'Opens STATUS.TXT, kept open across ncc_bytes calls until close().'
+        filen = self._status_path
+        # O_DIRECT bypasses the page cache, so every read reaches the device.
+        # It needs a page-aligned buffer, which self._status_buf (an anonymous
+        # mmap) is; STATUS.TXT is far smaller than that page, so one pread gets it.
+        fd = None
+        if self._status_direct:
+            try:
+                fd = os.open(filen, os.O_RDONLY | _O_DIRECT)
+            except OSError as e:
+                if e.errno != errno.EINVAL: raise
+                # Filesystem without O_DIRECT support; fall back to fadvise.
+                self._status_direct = False
+        self._status_cached = fd is None
+        self._status_fd = fd if fd is not None else os.open(filen, os.O_RDONLY)
+        st = os.fstat(self._status_fd)
+        self._status_id = (st.st_dev, st.st_ino)
+
+    def _pread_status(self):
+        'Reads STATUS.TXT from offset 0 into self._status_buf, returning the byte count.'
+        if self._status_cached and _fadvise:
+            # Only this one file's stale pages need dropping before the read;
+            # with O_DIRECT there are none to drop, so no syscalls are spent.
+            _fadvise(self._status_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            _fadvise(self._status_fd, 0, 0, os.POSIX_FADV_NOREUSE)
+        return os.preadv(self._status_fd, [self._status_buf], 0)
+
+    def close(self):
+        'Closes the STATUS.TXT handle kept by ncc_bytes, if open.'
+        if self._status_fd is not None:
+            fd, self._status_fd, self._status_id = self._status_fd, None, None
+            os.close(fd)
+
+    def __del__(self):
+        # Callers not using "with" or close() still get the handle released.
+        if getattr(self, '_status_fd', None) is not None:
+            self.close()
+        if getattr(self, '_status_buf', None) is not None:
+            self._status_buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ncc_bytes(self):
+        '''Low-level. Calls ncc binary for appropriate platform, returns raw output as bytes.
         Behaves like "no-cache-cat" (ncc) but in pure-python. Only works on Unix, possibly Linux.
         If this does not work correctly it is a silent failure; self-testing is essential
         to ensure that non-caching reads are executed successfully. If not, fallback to
         custom compiled C binaries would be necessary to get readouts.'''
-        if not self.ready:
+        st = self._stat_status()
+        if st is None:
             raise OpenPCRError("Device not ready, cannot read status.")
-        filen = os.path.join(self.devicepath,'STATUS.TXT')
-        with open(filen,"rb") as InF:
-            os.posix_fadvise(InF.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
-            fc = InF.read()
-        # Return until first null character.
-        # Odd null/whitespace pattern is incompatible with unicode mode.
-        return fc.split(b"\0",1)[0].decode()
-
-    def readstatus(self):
-        'Calls ncc and translates output into a dictionary of values.'
-        statustxt = self.ncc()
-        status = dict([x.split("=") for x in statustxt.split("&")])
-        statusd = {'state': status.get('s','Unknown'),
-                   'job': status.get('t','Unknown'),
-                   'blocktemp': float(status.get('b',0)),
-                   'lidtemp': float(status.get('l',0)),
-                   'elapsedsecs': int(status.get('e',0)),
-                   'secsleft': int(status.get('r',0)),
-                   'currentstep': status.get('p','Unknown'),
-                   'cycle': int(status.get('c',0)),
-                   'program': status.get('n','Unknown'),
-                   'nonce': int(status.get('d',-1)),
-                   }
+        if self._status_fd is not None and (st.st_dev, st.st_ino) != self._status_id:
+            # A different file is now at the path, e.g. the device re-appeared
+            # there; the held descriptor still reads the old one.
+            self.close()
+        if self._status_fd is None:
+            self._open_status()
+        try:
+            n = self._pread_status()
+        except OSError as e:
+            if e.errno == errno.EINVAL and not self._status_cached:
+                # Some filesystems (FUSE, network or stacked mounts) accept O_DIRECT
+                # at open but refuse the read; use the fadvise path from now on.
+                self._status_direct = False
+            # Reopen once; this also recovers a stale handle, e.g. after a remount.
+            self.close()
+            self._open_status()
+            n = self._pread_status()
+        # Return until first null character, copying out of the buffer only once.
+        nul = self._status_buf.find(b"\0", 0, n)
+        return self._status_buf[:nul if nul >= 0 else n]
+
+    def ncc(self):
+        'Calls ncc_bytes and decodes the output to a string.'
+        # Odd null/whitespace pattern is incompatible with unicode mode, hence bytes first.
+        return self.ncc_bytes().decode()
+
+    def readstatus(self, force=False):
+        '''Calls ncc and translates output into a dictionary of values.
+
+        The device only updates its status about once a second, so if the raw
+        status text is unchanged since the last call the previous parse is
+        reused. The file itself is always re-read; its mtime can't be trusted
+        to change on the device's mount. Pass force=True to always re-parse.'''
+        statustxt = self.ncc_bytes()
+        if not force and statustxt == self._last_statustxt:
+            statusd = self._last_status.copy()
+            # A failed parse in between may have changed self.active; restore it.
+            self.active = False if statusd['state'] in ['Complete','Inactive'] else True
+            statusd['currenttime'] = _currenttime()
+            return statusd
+        # Single pass over the raw bytes; only string-valued fields get decoded.
+        statusd = _status_defaults.copy()
+        for key, value in _status_re.findall(statustxt):
+            if key in _status_fields:
+                name, convert = _status_fields[key]
+                statusd[name] = convert(value)
         self.active = False if statusd['state'] in ['Complete','Inactive'] else True
         if statusd['nonce'] == -1:
             raise IOError("Received no program-identifier number from device - failure to communicate/reprogram?") 
         # Now to clean up TIME ITSELF
-        statusd['minsleft'] = statusd['secsleft'] // 60
-        statusd['hoursleft'] = statusd['minsleft'] // 60
-        extramins = statusd['minsleft'] - (statusd['hoursleft'] * 60)
-        extrasecs = statusd['secsleft'] - (statusd['minsleft'] * 60)
-        statusd['timeleft'] = '{0}:{1}:{2}'.format(statusd['hoursleft'], extramins, extrasecs)
-        statusd['currenttime'] = time.strftime("%H:%M:%S",time.localtime())
+        m, s = divmod(statusd['secsleft'], 60)
+        h, m = divmod(m, 60)
+        statusd['minsleft'] = h * 60 + m
+        statusd['hoursleft'] = h
+        statusd['timeleft'] = f'{h:d}:{m:02d}:{s:02d}' # Padded so the width stays stable.
+        self._last_statustxt, self._last_status = statustxt, statusd.copy()
+        statusd['currenttime'] = _currenttime()
         return statusd
 
     def csvstatus(self,keyorder = ['currenttime','elapsedsecs','cycle','blocktemp']):
@@ -137,9 +287,15 @@ class OpenPCR:
         keyorder is a list of dictionary keys to use, in desired order, when
         formatting output. The default provides the elapsed time in seconds,
         current cycle number, and temperature of the block.'''
-        # Assemble keyworded formatting string from keyorder argument, then
-        # unpack the dictionary result of self.readstatus into it to get return.
-        return ', '.join(['{'+k+'}' for k in keyorder]).format(**self.readstatus())
+        # Fetch the (cached) column getter for keyorder, then apply it to the
+        # dictionary result of self.readstatus.
+        return ', '.join(map(str, _csv_getter(tuple(keyorder))(self.readstatus())))
+
+    def poll_csv(self,keyorder = ['currenttime','elapsedsecs','cycle','blocktemp']):
+        '''As csvstatus, but returns (active, line), both taken from the same
+        status read, so loggers need no separate check of the device state.'''
+        line = self.csvstatus(keyorder)
+        return self.active, line
 
     def printstatus(self):
         'Calls readstatus and prints useful information to stdout.'
@@ -1,21 +1,27 @@
 #!/usr/bin/env python3
-import curses
 import time
 import sys
 import argparse
 from openpcrlib import OpenPCR
-import PCRCompiler
 
 class CursesDisplay():
     def __init__(self, screen, dev):
         self.scr = screen
         self.dev = dev
+        # Constant text of the status screen; printStatusMsg fills in the slots.
+        self._tmpl = ('Welcome to the OpenPyCR Real-time Monitor.\n'
+                      'Current Program: %s\n'
+                      ' Step "%s" of cycle %s\n'
+                      ' Currently: %s\n'
+                      ' Block: %sC, Lid: %sC\n'
+                      ' Remaining Time: %s\n(Press any key to exit monitor mode)')
 
     def monitor(self):
-        self.scr.nodelay(1) # Make self.scr.getch nonblocking.
+        # getch waits up to a second for a key, which also paces the refreshes;
+        # any keypress exits immediately rather than on the next refresh.
+        self.scr.timeout(1000)
         while True:
             self.printStatusMsg()
-            time.sleep(1)
             char = self.scr.getch()
             if char != -1:
                 break
@@ -28,23 +34,17 @@ class CursesDisplay():
     def printStatusMsg(self):
         S = self.dev.readstatus()
         try:
-            PrettyStatus = 'Welcome to the OpenPyCR Real-time Monitor.\n'
-            PrettyStatus += 'Current Program: {0}\n'.format(S['program'])
-            PrettyStatus += ' Step "{0}" of cycle {1}\n'.format(S['currentstep'],str(S['cycle']))
-            PrettyStatus += ' Currently: {0}\n'.format(S['job'])
-            PrettyStatus += ' Block: {0}C, Lid: {1}C\n'.format(str(S['blocktemp']),str(S['lidtemp']))
-            PrettyStatus += ' Remaining Time: {0}\n(Press any key to exit monitor mode)'.format(S['timeleft'])
+            PrettyStatus = self._tmpl % (S['program'], S['currentstep'], S['cycle'], S['job'],
+                                         S['blocktemp'], S['lidtemp'], S['timeleft'])
         except KeyError:
             PrettyStatus = 'Run Finished.\n(Press any key to exit monitor mode)'
         self.writeln(PrettyStatus)
 
 def CursesMonitor(dev):
-    stdscr = curses.initscr()
-    curses.cbreak()
-    Console = CursesDisplay(stdscr, dev)
-    Console.monitor()
-    curses.nocbreak()
-    curses.endwin()
+    import curses # Loads terminfo; only the monitor subcommand pays for it.
+    # curses.wrapper sets up cbreak mode and restores the terminal even if
+    # the monitor raises, so a device error can't leave the shell unusable.
+    curses.wrapper(lambda stdscr: CursesDisplay(stdscr, dev).monitor())
 
 #======= Functions for Terminal Use Follow ========
 def status(device, args):
@@ -56,31 +56,48 @@ def monitor(device, args):
 def send(device, args):
     with args.program_file as InF:
         program = InF.read().strip()
-    program = PCRCompiler.parse_program(program)
+    if not args.raw:
+        import PCRCompiler # Only needed here and for compile, so imported on use.
+        program = PCRCompiler.parse_program(program)
     device.sendprogram(program)
 
 def stop(device, args):
     device.stop()
     
 def log(device, args):
-    # args.interval and args.output_file
+    # args.interval and args.output_file, which is a binary stream so lines
+    # are written as bytes without going through a text wrapper.
     with args.output_file as LogF:
-        lastflush = time.time()
+        # Someone watching a terminal wants each line as it comes; otherwise
+        # lines are only flushed per args.flush_interval.
+        flush_each = LogF.isatty()
+        lastflush = time.monotonic_ns()
+        flush_ns = args.flush_interval * 1_000_000_000
+        # Ticks are scheduled on the monotonic clock so time spent reading
+        # status doesn't make the log drift; missed ticks are skipped, not replayed.
+        next_tick = time.monotonic()
         try:
             while True:
-                LogLine = device.csvstatus(args.columns)
-                if device.active:
-                    LogF.write(LogLine+"\n")
-                else:
+                active, LogLine = device.poll_csv(args.columns)
+                if not active:
                     break
-                if lastflush >= args.flush_interval:
-                    lastflush = time.time()
+                LogF.write(LogLine.encode()+b"\n")
+                if flush_each:
+                    LogF.flush()
+                if time.monotonic_ns() - lastflush >= flush_ns:
+                    lastflush = time.monotonic_ns()
                     LogF.flush()
-                time.sleep(args.interval)
+                next_tick += args.interval
+                now = time.monotonic()
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                else:
+                    next_tick = now
         except KeyboardInterrupt:
             pass
 
 def pcrcompile(device, args):
+    import PCRCompiler
     with args.program_file as InF:
         print(PCRCompiler.parse_program(InF.read()))
 
@@ -100,6 +117,8 @@ P_monitor.set_defaults(function = monitor)
 P_send = Subs.add_parser('send',help="Send a string or file as a program to the OpenPCR device.")
 P_send.add_argument("-p","--program-file",type=argparse.FileType("r"),default=sys.stdin,
                         help="Program to send. If not specified, reads from standard input.")
+P_send.add_argument("--raw",action="store_true",
+                        help="Send the program as-is, already in the lower-level OpenPCR format, without compiling it.")
 P_send.set_defaults(function = send)
 
 P_stop = Subs.add_parser('stop',help='Send the stop signal to the OpenPCR to terminate current program.')
@@ -108,7 +127,7 @@ P_stop.set_defaults(function = stop)
 P_log = Subs.add_parser('log',help='Print (or append to file) status information in csv format at set intervals.')
 P_log.set_defaults(function = log)
 P_log.add_argument("-i","--interval",type=int,default=5,help="Interval in seconds between log entries.")
-P_log.add_argument("-o","--output-file",type=argparse.FileType("a"),default=sys.stdout,
+P_log.add_argument("-o","--output-file",type=argparse.FileType("ab",bufsize=1<<16),default=sys.stdout.buffer,
                         help="File to append log output to. Default is stdout; print to terminal.")
 P_log.add_argument("--columns",nargs="+",type=str,default=['currenttime','elapsedsecs','cycle','blocktemp'],
                         help="Columns to print to log. Options are: state job blocktemp lidtemp elapsedsecs secsleft currentstep cycle program nonce minsleft hoursleft timeleft currenttime")
@@ -123,8 +142,8 @@ P_compile.add_argument("-p","--program-file",type=argparse.FileType("r"),default
 # Parse arguments, and pass arguments into the associated function for handling
 # according to appropriate subcommand.
 A = P.parse_args()
-Dev = OpenPCR(devicepath = A.device_mountpoint)
-if not hasattr(A,"function"):
-    P.print_usage()
-else:
-    A.function(Dev, A)
+with OpenPCR(devicepath = A.device_mountpoint) as Dev:
+    if not hasattr(A,"function"):
+        P.print_usage()
+    else:
+        A.function(Dev, A)
@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 import os
-import mmap
 import sys
-if sys.version_info[:2] < (3,3):
-    # native posix_fadvise introduced in 3.3, can shim in with ctypes:
-    import ctypes
-    libc = ctypes.CDLL("libc.so.6")
-    os.posix_fadvise = libc.posix_fadvise
-    os.POSIX_FADV_NORMAL     = 0
-    os.POSIX_FADV_RANDOM     = 1
-    os.POSIX_FADV_SEQUENTIAL = 2
-    os.POSIX_FADV_WILLNEED   = 3
-    os.POSIX_FADV_DONTNEED   = 4
-    os.POSIX_FADV_NOREUSE    = 5
+
+_CHUNK = 4096
+
+def pyncc(filen):
+    '''Reads filen as "no-cache-cat" would, dropping any cached copy first,
+    and returns its contents as bytes up to the first null character.'''
+    fd = os.open(filen, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        # With the stale pages gone, have the kernel start reading ahead now.
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # Read a page at a time and stop at the first null character, so a
+        # short status in a large file doesn't cost a whole-file read.
+        chunks = []
+        while True:
+            chunk = os.read(fd, _CHUNK)
+            nul = chunk.find(b"\0")
+            if nul >= 0:
+                chunks.append(chunk[:nul])
+                break
+            chunks.append(chunk)
+            if len(chunk) < _CHUNK:
+                break
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
 
 if __name__ == "__main__":
-    import sys
-    with open(sys.argv[1],"rb") as InF:
-        os.posix_fadvise(InF.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
-        print(InF.read().split(b"\0",1)[0].decode())
+    print(pyncc(sys.argv[1]).decode())